@@ -2,11 +2,16 @@ from flask import Flask, jsonify
 from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
+from config import Config
+from profiling import init_profiling
+from deadlines import deadline_exceeded_response, init_deadlines, is_timeout
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+init_profiling(app, Config)
+init_deadlines(app, Config)
 
 # MongoDB configuration
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
@@ -60,6 +65,8 @@ def get_roster():
 
     except Exception as e:
         print(f"❌ Error in /api/roster: {e}")
+        if is_timeout(e):
+            return deadline_exceeded_response()
         import traceback
         traceback.print_exc()
         return jsonify({
@@ -3,16 +3,39 @@ Advanced Flask application with extended features for Manchester Seals API
 This file can be used as an extension or replacement for app.py with more features
 """
 
-from flask import Flask, jsonify, request
-from pymongo import MongoClient
+from flask import Flask, jsonify, request, g
+from pymongo import MongoClient, IndexModel
+from pymongo.read_preferences import (
+    Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+)
 from bson.objectid import ObjectId
+from bson.timestamp import Timestamp
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from urllib.parse import urlencode
+import json
+import math
 import os
 from dotenv import load_dotenv
+from config import Config
+from group_commit import GroupCommitter
+from profiling import init_profiling
+from deadlines import (
+    check_deadline, deadline_exceeded_response, deadline_stats, init_deadlines,
+    is_timeout, remaining
+)
+from roster_query import QueryError, parse_roster_query
+from shared_cache import SharedResponseCache, default_cache_path
+from roster_snapshot import (
+    RosterSnapshot, headcount_over_time, salary_percentiles, tenure_distribution
+)
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+init_profiling(app, Config)
+init_deadlines(app, Config)
 
 # MongoDB connection setup
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
@@ -20,7 +43,7 @@ DB_NAME = os.getenv('DB_NAME', 'manchester_seals')
 COLLECTION_NAME = 'roster'
 
 try:
-    client = MongoClient(MONGO_URI)
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
     db = client[DB_NAME]
     roster_collection = db[COLLECTION_NAME]
     # Test connection
@@ -30,6 +53,12 @@ except Exception as e:
     print(f"Error connecting to MongoDB: {e}")
     roster_collection = None
 
+if roster_collection is not None:
+    try:
+        roster_collection.create_indexes([IndexModel(keys) for keys in Config.ROSTER_INDEXES])
+    except Exception as e:
+        print(f"⚠️  Could not create roster indexes: {e}")
+
 
 def convert_objectid(document):
     """Convert ObjectId to string in document"""
@@ -43,16 +72,213 @@ def convert_objectid_list(documents):
     return [convert_objectid(doc) for doc in documents]
 
 
+# ==================== READ ROUTING & SESSIONS ====================
+
+READ_PREFERENCE_MODES = {
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest
+}
+
+
+def build_read_preference(settings):
+    """Build a pymongo read preference from a Config.READ_PREFERENCES entry"""
+    mode = settings.get('mode', 'primary')
+    if mode == 'primary':
+        return Primary()
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"Unknown read preference mode: {mode}")
+    return READ_PREFERENCE_MODES[mode](
+        max_staleness=settings.get('max_staleness_seconds', -1)
+    )
+
+
+READ_PREFERENCES = {
+    endpoint: build_read_preference(settings)
+    for endpoint, settings in Config.READ_PREFERENCES.items()
+}
+
+response_cache = None
+if Config.CACHE_ENABLED:
+    # Keep deployments that share a host (and a CACHE_PATH) apart
+    cache_namespace = f"{Config.MONGO_URI}|{Config.DB_NAME}"
+    cache_size = Config.CACHE_SIZE_MB * 1024 * 1024
+    response_cache = SharedResponseCache(
+        Config.CACHE_PATH or default_cache_path(
+            cache_namespace, cache_size, Config.CACHE_SLOT_BYTES
+        ),
+        cache_size,
+        slot_bytes=Config.CACHE_SLOT_BYTES,
+        ttl_seconds=Config.CACHE_TTL_SECONDS,
+        namespace=cache_namespace
+    )
+    # Refuse to start rather than serve from a cache file laid out differently
+    response_cache.open()
+
+roster_snapshot = None
+if Config.SNAPSHOT_ENABLED and roster_collection is not None:
+    roster_snapshot = RosterSnapshot(
+        roster_collection.with_options(
+            read_preference=READ_PREFERENCES['get_stats_by_department']
+        ),
+        refresh_seconds=Config.SNAPSHOT_REFRESH_SECONDS,
+        min_refresh_seconds=Config.SNAPSHOT_MIN_REFRESH_SECONDS,
+        # Every worker's writes bump the shared cache generation
+        write_generation=response_cache.generation if response_cache is not None else None
+    )
+    roster_snapshot.start()
+
+
+def read_collection():
+    """Return the roster collection bound to the current route's read preference"""
+    check_deadline()
+    if g.get('filling_cache'):
+        # A secondary may not have applied the write that invalidated the
+        # cache yet, and its answer would then be cached as current
+        return roster_collection.with_options(read_preference=Primary())
+    read_preference = READ_PREFERENCES.get(request.endpoint)
+    if read_preference is None:
+        return roster_collection
+    return roster_collection.with_options(read_preference=read_preference)
+
+
+def parse_session_token(token):
+    """Parse a '<seconds>.<increment>' session token into a BSON Timestamp"""
+    seconds, increment = token.split('.')
+    return Timestamp(int(seconds), int(increment))
+
+
+def format_session_token(operation_time):
+    """Format a session operation time as a '<seconds>.<increment>' token"""
+    return f"{operation_time.time}.{operation_time.inc}"
+
+
+def read_session():
+    """
+    Start a causally consistent session when the client sent a session token,
+    so reads routed to a secondary observe the client's earlier writes
+    """
+    operation_time = g.get('session_operation_time')
+    if operation_time is None:
+        return nullcontext()
+    session = client.start_session(causal_consistency=True)
+    session.advance_operation_time(operation_time)
+    return session
+
+
+@contextmanager
+def write_session():
+    """Run a write in a causally consistent session and hand its token back"""
+    check_deadline()
+    with client.start_session(causal_consistency=True) as session:
+        yield session
+        if session.operation_time is not None:
+            g.session_token = format_session_token(session.operation_time)
+
+
+def notify_write():
+    """Let derived read models know the roster changed"""
+    if response_cache is not None:
+        response_cache.invalidate()
+    if roster_snapshot is not None:
+        roster_snapshot.mark_dirty()
+
+
+# The flusher notifies for every batch, including ones whose requests timed out
+group_committer = None
+if Config.GROUP_COMMIT_ENABLED and roster_collection is not None:
+    group_committer = GroupCommitter(
+        roster_collection,
+        max_batch_size=Config.GROUP_COMMIT_MAX_BATCH_SIZE,
+        max_wait_ms=Config.GROUP_COMMIT_MAX_WAIT_MS,
+        timeout_ms=Config.GROUP_COMMIT_TIMEOUT_MS,
+        on_commit=notify_write
+    )
+
+
+# ==================== RESPONSE CACHE ====================
+
+def response_cache_key(endpoint, id='', args=()):
+    """Cache key for a response of an endpoint"""
+    return f"{endpoint}|{id}|{urlencode(sorted(args))}"
+
+
+def cached_response(when=None):
+    """
+    Serve a view from the shared response cache, storing its 200 responses
+    Misses are read from the primary so no pre-write data is cached; requests
+    carrying a session token bypass the cache so they read their writes
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if (response_cache is None or roster_collection is None
+                    or g.get('session_operation_time') is not None
+                    or (when is not None and not when())):
+                return view(*args, **kwargs)
+
+            key = response_cache_key(
+                request.endpoint, kwargs.get('id', ''), request.args.items(multi=True)
+            )
+            cached = response_cache.get(key)
+            if cached is not None:
+                status, body = cached
+                response = app.response_class(body, status=status, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            generation = response_cache.generation()
+            g.filling_cache = True
+            response, status = view(*args, **kwargs)
+            if status == 200:
+                response_cache.set(key, status, response.get_data(), generation)
+            response.headers['X-Cache'] = 'MISS'
+            return response, status
+        return wrapper
+    return decorator
+
+
+@app.before_request
+def load_session_token():
+    """Validate the session token sent by the client, if any"""
+    token = request.headers.get(Config.SESSION_TOKEN_HEADER)
+    if not token:
+        return None
+    try:
+        g.session_operation_time = parse_session_token(token)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid session token'
+        }), 400
+    return None
+
+
+@app.after_request
+def attach_session_token(response):
+    """Return the session token of a write so clients can read their writes"""
+    token = g.get('session_token')
+    if token:
+        response.headers[Config.SESSION_TOKEN_HEADER] = token
+    return response
+
+
 # ==================== ROSTER ENDPOINTS ====================
 
 @app.route('/api/roster', methods=['GET'])
+@cached_response(when=lambda: request.args.get('page', 1, type=int) <= 1)
 def get_roster():
     """
-    Fetch all roster data with optional pagination and filtering
+    Fetch all roster data with optional pagination, filtering and sorting
     Query parameters:
     - page: Page number (default: 1)
     - limit: Results per page (default: 10)
     - search: Search by name
+    - <field>, <field>[op]: Filter by field (op: eq, ne, gt, gte, lt, lte, in)
+    - sort: Sort keys, e.g. "department,-salary"
+    Filterable and sortable fields: name, position, department, email,
+    salary, hire_date
     """
     try:
         if roster_collection is None:
@@ -71,19 +297,45 @@ def get_roster():
         limit = min(max(limit, 1), 100)  # Max 100 per page
 
         # Build query
-        query = {}
+        try:
+            query, sort, indexed = parse_roster_query(request.args, Config.ROSTER_INDEXES)
+        except QueryError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+
+        warnings = []
+        if not indexed:
+            if Config.UNINDEXED_QUERY_POLICY == 'reject':
+                return jsonify({
+                    'success': False,
+                    'error': 'No index supports this combination of filters and sort'
+                }), 400
+            warnings.append('No index supports this combination of filters and sort')
+
         if search:
+            if 'name' in query:
+                return jsonify({
+                    'success': False,
+                    'error': 'search cannot be combined with a name filter'
+                }), 400
             query['name'] = {'$regex': search, '$options': 'i'}
 
-        # Get total count
-        total = roster_collection.count_documents(query)
-
-        # Fetch paginated data
-        skip = (page - 1) * limit
-        roster_data = list(roster_collection.find(query).skip(skip).limit(limit))
+        collection = read_collection()
+        with read_session() as session:
+            # Get total count
+            total = collection.count_documents(query, session=session)
+
+            # Fetch paginated data
+            skip = (page - 1) * limit
+            cursor = collection.find(query, session=session)
+            if sort:
+                cursor = cursor.sort(sort)
+            roster_data = list(cursor.skip(skip).limit(limit))
         roster_data = convert_objectid_list(roster_data)
 
-        return jsonify({
+        response = {
             'success': True,
             'count': len(roster_data),
             'total': total,
@@ -91,9 +343,14 @@ def get_roster():
             'limit': limit,
             'pages': (total + limit - 1) // limit,
             'data': roster_data
-        }), 200
+        }
+        if warnings:
+            response['warnings'] = warnings
+        return jsonify(response), 200
 
     except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -101,6 +358,7 @@ def get_roster():
 
 
 @app.route('/api/roster/<id>', methods=['GET'])
+@cached_response()
 def get_roster_by_id(id):
     """
     Fetch a single roster entry by ID
@@ -120,7 +378,8 @@ def get_roster_by_id(id):
                 'error': 'Invalid ID format'
             }), 400
 
-        data = roster_collection.find_one({'_id': object_id})
+        with read_session() as session:
+            data = read_collection().find_one({'_id': object_id}, session=session)
 
         if data:
             data = convert_objectid(data)
@@ -135,6 +394,101 @@ def get_roster_by_id(id):
         }), 404
 
     except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/roster/batch-get', methods=['POST'])
+def batch_get_roster():
+    """
+    Fetch many roster entries by ID in a single query
+    Request body should be JSON:
+    {
+        "ids": ["507f1f77bcf86cd799439011", "507f1f77bcf86cd799439012"]
+    }
+    Results are returned in request order; IDs that do not exist are
+    returned with "found": false
+    """
+    try:
+        if roster_collection is None:
+            return jsonify({
+                'success': False,
+                'error': 'Database connection failed'
+            }), 500
+
+        data = request.get_json(silent=True)
+        ids = data.get('ids') if isinstance(data, dict) else None
+
+        if not isinstance(ids, list) or not ids:
+            return jsonify({
+                'success': False,
+                'error': 'A non-empty list of ids is required'
+            }), 400
+
+        if len(ids) > Config.MAX_BATCH_GET_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f'Too many ids (max {Config.MAX_BATCH_GET_SIZE})'
+            }), 400
+
+        invalid_ids = [id for id in ids
+                       if not isinstance(id, str) or not ObjectId.is_valid(id)]
+        if invalid_ids:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid ID format',
+                'invalid_ids': invalid_ids
+            }), 400
+
+        # Serve what we can from the response cache, unless reading own writes
+        found = {}
+        use_cache = response_cache is not None and g.get('session_operation_time') is None
+        if use_cache:
+            generation = response_cache.generation()
+            g.filling_cache = True
+            for id in set(ids):
+                cached = response_cache.get(response_cache_key('get_roster_by_id', id))
+                if cached is not None:
+                    document = json.loads(cached[1])['data']
+                    found[document['_id']] = document
+
+        object_ids = list({ObjectId(id) for id in ids} - {ObjectId(id) for id in found})
+        if object_ids:
+            with read_session() as session:
+                documents = read_collection().find(
+                    {'_id': {'$in': object_ids}}, session=session
+                )
+                fetched = convert_objectid_list(documents)
+            for document in fetched:
+                found[document['_id']] = document
+                if use_cache:
+                    response_cache.set(
+                        response_cache_key('get_roster_by_id', document['_id']), 200,
+                        jsonify({'success': True, 'data': document}).get_data(), generation
+                    )
+
+        results = []
+        for id in ids:
+            document = found.get(str(ObjectId(id)))
+            if document is None:
+                results.append({'id': id, 'found': False})
+            else:
+                results.append({'id': id, 'found': True, 'data': document})
+
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'found': sum(1 for result in results if result['found']),
+            'data': results
+        }), 200
+
+    except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -175,8 +529,16 @@ def create_roster():
                 'error': 'Name is required'
             }), 400
 
-        # Insert document
-        result = roster_collection.insert_one(data)
+        # Insert document, batched with concurrent requests when group commit is on
+        if group_committer is not None:
+            check_deadline()
+            result = group_committer.submit(data, timeout=remaining())
+            if result.operation_time is not None:
+                g.session_token = format_session_token(result.operation_time)
+        else:
+            with write_session() as session:
+                result = roster_collection.insert_one(data, session=session)
+            notify_write()
 
         return jsonify({
             'success': True,
@@ -185,6 +547,8 @@ def create_roster():
         }), 201
 
     except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -220,10 +584,13 @@ def update_roster(id):
             }), 400
 
         # Update document
-        result = roster_collection.update_one(
-            {'_id': object_id},
-            {'$set': data}
-        )
+        with write_session() as session:
+            result = roster_collection.update_one(
+                {'_id': object_id},
+                {'$set': data},
+                session=session
+            )
+        notify_write()
 
         if result.matched_count == 0:
             return jsonify({
@@ -238,6 +605,8 @@ def update_roster(id):
         }), 200
 
     except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -264,7 +633,9 @@ def delete_roster(id):
                 'error': 'Invalid ID format'
             }), 400
 
-        result = roster_collection.delete_one({'_id': object_id})
+        with write_session() as session:
+            result = roster_collection.delete_one({'_id': object_id}, session=session)
+        notify_write()
 
         if result.deleted_count == 0:
             return jsonify({
@@ -278,6 +649,8 @@ def delete_roster(id):
         }), 200
 
     except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -287,6 +660,7 @@ def delete_roster(id):
 # ==================== STATISTICS ENDPOINTS ====================
 
 @app.route('/api/roster/stats/count', methods=['GET'])
+@cached_response()
 def get_roster_count():
     """
     Get total count of roster entries
@@ -298,7 +672,8 @@ def get_roster_count():
                 'error': 'Database connection failed'
             }), 500
 
-        count = roster_collection.count_documents({})
+        with read_session() as session:
+            count = read_collection().count_documents({}, session=session)
 
         return jsonify({
             'success': True,
@@ -306,6 +681,8 @@ def get_roster_count():
         }), 200
 
     except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -313,6 +690,7 @@ def get_roster_count():
 
 
 @app.route('/api/roster/stats/by-department', methods=['GET'])
+@cached_response()
 def get_stats_by_department():
     """
     Get roster count grouped by department
@@ -336,7 +714,8 @@ def get_stats_by_department():
             }
         ]
 
-        stats = list(roster_collection.aggregate(pipeline))
+        with read_session() as session:
+            stats = list(read_collection().aggregate(pipeline, session=session))
 
         return jsonify({
             'success': True,
@@ -344,6 +723,123 @@ def get_stats_by_department():
         }), 200
 
     except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+def snapshot_columns():
+    """Return the snapshot columns, or an error response if they are unavailable"""
+    if roster_snapshot is None:
+        return None, (jsonify({
+            'success': False,
+            'error': 'Roster snapshot is disabled (set SNAPSHOT_ENABLED=True)'
+        }), 503)
+    columns = roster_snapshot.columns()
+    if columns is None:
+        return None, (jsonify({
+            'success': False,
+            'error': 'Roster snapshot is warming up, try again shortly'
+        }), 503)
+    return columns, None
+
+
+@app.route('/api/roster/stats/salary-percentiles', methods=['GET'])
+def get_salary_percentiles():
+    """
+    Get salary percentiles per department from the roster snapshot
+    Query parameters:
+    - percentiles: Comma-separated percentiles (default: 25,50,75,90)
+    """
+    try:
+        try:
+            percentiles = [
+                float(p) for p in request.args.get('percentiles', '25,50,75,90').split(',')
+            ]
+        except ValueError:
+            percentiles = None
+        if not percentiles or any(
+                not math.isfinite(p) or p < 0 or p > 100 for p in percentiles):
+            return jsonify({
+                'success': False,
+                'error': 'percentiles must be numbers between 0 and 100'
+            }), 400
+
+        columns, error = snapshot_columns()
+        if error:
+            return error
+
+        return jsonify({
+            'success': True,
+            'data': salary_percentiles(columns, percentiles),
+            'snapshot': roster_snapshot.describe(columns)
+        }), 200
+
+    except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/roster/stats/tenure', methods=['GET'])
+def get_tenure_distribution():
+    """
+    Get headcount per tenure bucket (years since hire_date) from the roster snapshot
+    """
+    try:
+        columns, error = snapshot_columns()
+        if error:
+            return error
+
+        return jsonify({
+            'success': True,
+            'data': tenure_distribution(columns),
+            'snapshot': roster_snapshot.describe(columns)
+        }), 200
+
+    except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/roster/stats/headcount', methods=['GET'])
+def get_headcount_over_time():
+    """
+    Get cumulative headcount by hire date from the roster snapshot
+    Query parameters:
+    - interval: year or month (default: year)
+    """
+    try:
+        interval = request.args.get('interval', 'year')
+        if interval not in ('year', 'month'):
+            return jsonify({
+                'success': False,
+                'error': 'interval must be year or month'
+            }), 400
+
+        columns, error = snapshot_columns()
+        if error:
+            return error
+
+        return jsonify({
+            'success': True,
+            'data': headcount_over_time(columns, interval),
+            'snapshot': roster_snapshot.describe(columns)
+        }), 200
+
+    except Exception as e:
+        if is_timeout(e):
+            return deadline_exceeded_response()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -352,6 +848,19 @@ def get_stats_by_department():
 
 # ==================== HEALTH & INFO ENDPOINTS ====================
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Internal counters for optional write and read paths
+    """
+    return jsonify({
+        'success': True,
+        'group_commit': group_committer.stats() if group_committer else None,
+        'response_cache': response_cache.describe() if response_cache else None,
+        'deadlines': deadline_stats()
+    }), 200
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """
@@ -371,13 +880,18 @@ def api_info():
     API information and available endpoints
     """
     endpoints = {
-        'GET /api/roster': 'Fetch all roster data (supports pagination and search)',
+        'GET /api/roster': 'Fetch all roster data (supports pagination, search, filters and sort)',
         'GET /api/roster/<id>': 'Fetch a single roster entry by ID',
+        'POST /api/roster/batch-get': 'Fetch many roster entries by ID in one query',
         'POST /api/roster': 'Create a new roster entry',
         'PUT /api/roster/<id>': 'Update a roster entry by ID',
         'DELETE /api/roster/<id>': 'Delete a roster entry by ID',
         'GET /api/roster/stats/count': 'Get total roster count',
         'GET /api/roster/stats/by-department': 'Get roster count by department',
+        'GET /api/roster/stats/salary-percentiles': 'Get salary percentiles per department (snapshot)',
+        'GET /api/roster/stats/tenure': 'Get tenure distribution (snapshot)',
+        'GET /api/roster/stats/headcount': 'Get headcount over time (snapshot)',
+        'GET /api/metrics': 'Internal counters (group commit, response cache, deadlines)',
         'GET /api/health': 'Health check',
         'GET /api/info': 'API information'
     }
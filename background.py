@@ -0,0 +1,34 @@
+"""
+Lazily started background threads
+
+Worker threads do not survive a fork, so a pre-forking server would leave
+the workers with a dead thread object copied from the master. The thread is
+therefore (re)started on demand whenever it is not alive, and the child gets
+a fresh lock in case the fork happened while it was held.
+"""
+import os
+import threading
+
+
+class BackgroundThread:
+    """Daemon thread running target, started on first use and after a fork"""
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._thread = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the thread unless it is already running in this process"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+                self._thread.start()
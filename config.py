@@ -15,6 +15,94 @@ class Config:
     DB_NAME = os.getenv('DB_NAME', 'manchester_seals')
     PORT = int(os.getenv('PORT', 5100))
 
+    # Read preference per route (keyed by Flask endpoint name). Routes that
+    # are not listed here read from the primary.
+    MAX_STALENESS_SECONDS = int(os.getenv('MAX_STALENESS_SECONDS', 90))
+    READ_PREFERENCES = {
+        'get_roster_by_id': {
+            'mode': os.getenv('READ_PREFERENCE_BY_ID', 'primaryPreferred')
+        },
+        'batch_get_roster': {
+            'mode': os.getenv('READ_PREFERENCE_BY_ID', 'primaryPreferred')
+        },
+        'get_roster': {
+            'mode': os.getenv('READ_PREFERENCE_LIST', 'secondaryPreferred'),
+            'max_staleness_seconds': MAX_STALENESS_SECONDS
+        },
+        'get_roster_count': {
+            'mode': os.getenv('READ_PREFERENCE_STATS', 'secondaryPreferred'),
+            'max_staleness_seconds': MAX_STALENESS_SECONDS
+        },
+        'get_stats_by_department': {
+            'mode': os.getenv('READ_PREFERENCE_STATS', 'secondaryPreferred'),
+            'max_staleness_seconds': MAX_STALENESS_SECONDS
+        }
+    }
+
+    # Maximum number of ids accepted by a single batch-get request
+    MAX_BATCH_GET_SIZE = int(os.getenv('MAX_BATCH_GET_SIZE', 500))
+
+    # Group commit: merge concurrent single-record POSTs into one insert_many
+    GROUP_COMMIT_ENABLED = os.getenv('GROUP_COMMIT_ENABLED', 'False').lower() == 'true'
+    GROUP_COMMIT_MAX_BATCH_SIZE = int(os.getenv('GROUP_COMMIT_MAX_BATCH_SIZE', 100))
+    GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv('GROUP_COMMIT_MAX_WAIT_MS', 5))
+    GROUP_COMMIT_TIMEOUT_MS = float(os.getenv('GROUP_COMMIT_TIMEOUT_MS', 5000))
+
+    # Per-request profiling: requests sent with a matching X-Profile-Token
+    # header, or picked by PROFILE_SAMPLE_RATE, write a collapsed-stack file
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'False').lower() == 'true'
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 1))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+    # Indexes created on the roster collection at startup. List filters and
+    # sorts that none of them serve are rejected or answered with a warning
+    # depending on UNINDEXED_QUERY_POLICY ('warn' or 'reject')
+    # Sorted lists add an _id tie-breaker, so each index ends with _id
+    ROSTER_INDEXES = [
+        [('name', 1), ('_id', 1)],
+        [('department', 1), ('salary', 1), ('_id', 1)],
+        [('department', 1), ('hire_date', 1), ('_id', 1)],
+        [('salary', 1), ('_id', 1)],
+        [('hire_date', 1), ('_id', 1)]
+    ]
+    UNINDEXED_QUERY_POLICY = os.getenv('UNINDEXED_QUERY_POLICY', 'warn')
+
+    # Columnar roster snapshot backing the /api/roster/stats/* analytics.
+    # Refreshed every SNAPSHOT_REFRESH_SECONDS, and after writes at most once
+    # per SNAPSHOT_MIN_REFRESH_SECONDS
+    SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', 'False').lower() == 'true'
+    SNAPSHOT_REFRESH_SECONDS = float(os.getenv('SNAPSHOT_REFRESH_SECONDS', 300))
+    SNAPSHOT_MIN_REFRESH_SECONDS = float(os.getenv('SNAPSHOT_MIN_REFRESH_SECONDS', 5))
+
+    # Response cache shared by all worker processes on the host through an
+    # mmap-backed file (under /dev/shm when CACHE_PATH is not set). Holds
+    # get-by-id, first-page list and stats responses; writes invalidate it
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'False').lower() == 'true'
+    CACHE_PATH = os.getenv('CACHE_PATH', '')
+    CACHE_SIZE_MB = int(os.getenv('CACHE_SIZE_MB', 64))
+    CACHE_SLOT_BYTES = int(os.getenv('CACHE_SLOT_BYTES', 16384))
+    CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 60))
+
+    # Request deadlines: each request gets a time budget from the client's
+    # X-Request-Timeout-Ms header (capped at MAX_REQUEST_TIMEOUT_MS) or the
+    # per-route default below, propagated into MongoDB as maxTimeMS
+    REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+    DEFAULT_REQUEST_TIMEOUT_MS = float(os.getenv('DEFAULT_REQUEST_TIMEOUT_MS', 5000))
+    MAX_REQUEST_TIMEOUT_MS = float(os.getenv('MAX_REQUEST_TIMEOUT_MS', 30000))
+    REQUEST_TIMEOUTS_MS = {
+        'get_roster_by_id': 1000,
+        'batch_get_roster': 2000,
+        'get_roster': 3000,
+        'get_roster_count': 3000,
+        'get_stats_by_department': 5000
+    }
+
+    # Header used to hand causal-consistency session tokens to clients after
+    # a write, and to accept them back on reads (read-your-writes)
+    SESSION_TOKEN_HEADER = 'X-Session-Token'
+
 
 class DevelopmentConfig(Config):
     """Development configuration"""
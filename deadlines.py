@@ -0,0 +1,125 @@
+"""
+End-to-end request deadlines for the Manchester Seals API
+
+Every request gets a time budget, from the client's timeout header or the
+per-route default in config. The view runs inside pymongo.timeout(), so each
+MongoDB operation is sent with a maxTimeMS for whatever budget is left, and
+operations are not started at all once it has run out. Requests that run
+out of time are answered with a 504.
+"""
+import math
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pymongo
+from flask import g, jsonify, request
+from pymongo.errors import ExecutionTimeout, PyMongoError
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has no time left for further work"""
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    'requests': 0,
+    'client_deadlines': 0,
+    'expired_on_arrival': 0,
+    'exceeded': 0,
+    'exceeded_by_endpoint': {}
+}
+
+
+def _count(name, endpoint=None):
+    with _stats_lock:
+        _stats[name] += 1
+        if endpoint is not None:
+            by_endpoint = _stats['exceeded_by_endpoint']
+            by_endpoint[endpoint] = by_endpoint.get(endpoint, 0) + 1
+
+
+def deadline_stats():
+    """Snapshot of the deadline counters of this process"""
+    with _stats_lock:
+        return {**_stats, 'exceeded_by_endpoint': dict(_stats['exceeded_by_endpoint'])}
+
+
+def remaining():
+    """Seconds left before the current request's deadline (None without one)"""
+    deadline = g.get('deadline')
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current request has run out of time"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('Request deadline exceeded')
+
+
+def is_timeout(error):
+    """
+    Whether an error means the request ran out of time
+    A server-side maxTimeMS expiry always does. Other timeouts (server
+    selection, network, waiting for a group commit) only count once the
+    budget is spent, so an unreachable MongoDB is reported as a failure
+    """
+    if isinstance(error, (DeadlineExceeded, ExecutionTimeout)):
+        return True
+    if isinstance(error, FutureTimeoutError) or (
+            isinstance(error, PyMongoError) and error.timeout):
+        left = remaining()
+        return left is not None and left <= 0
+    return False
+
+
+def deadline_exceeded_response():
+    """504 response for a request that ran out of time, counted in the metrics"""
+    _count('exceeded', request.endpoint)
+    return jsonify({
+        'success': False,
+        'error': 'Request deadline exceeded'
+    }), 504
+
+
+def init_deadlines(app, config):
+    """Give every request of an app a deadline propagated into MongoDB"""
+
+    @app.before_request
+    def start_deadline():
+        budget_ms = config.REQUEST_TIMEOUTS_MS.get(
+            request.endpoint, config.DEFAULT_REQUEST_TIMEOUT_MS
+        )
+        header = request.headers.get(config.REQUEST_TIMEOUT_HEADER)
+        if header is not None:
+            try:
+                budget_ms = float(header)
+            except ValueError:
+                budget_ms = math.nan
+            if not math.isfinite(budget_ms):
+                return jsonify({
+                    'success': False,
+                    'error': f'Invalid {config.REQUEST_TIMEOUT_HEADER} header'
+                }), 400
+            budget_ms = min(budget_ms, config.MAX_REQUEST_TIMEOUT_MS)
+            _count('client_deadlines')
+
+        _count('requests')
+        g.deadline = time.monotonic() + budget_ms / 1000.0
+        if budget_ms <= 0:
+            _count('expired_on_arrival')
+            return deadline_exceeded_response()
+
+        # Held open until teardown so the view's MongoDB calls share the budget
+        g.mongo_timeout = pymongo.timeout(budget_ms / 1000.0)
+        g.mongo_timeout.__enter__()
+        return None
+
+    @app.teardown_request
+    def end_deadline(error=None):
+        mongo_timeout = g.pop('mongo_timeout', None)
+        if mongo_timeout is not None:
+            mongo_timeout.__exit__(None, None, None)
@@ -0,0 +1,156 @@
+"""
+Group commit for roster inserts
+
+Concurrent single-record inserts are queued and flushed by a background
+thread as one insert_many, so many requests share a single round trip and
+write-concern wait.
+"""
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import pymongo
+from pymongo.errors import BulkWriteError, WriteConcernError, WriteError
+
+from background import BackgroundThread
+
+GroupCommitResult = namedtuple('GroupCommitResult', ['inserted_id', 'operation_time'])
+
+
+class GroupCommitter:
+    """Merge concurrently submitted documents into batched insert_many calls"""
+
+    def __init__(self, collection, max_batch_size=100, max_wait_ms=5, timeout_ms=5000,
+                 on_commit=None):
+        self.collection = collection
+        self.on_commit = on_commit
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = BackgroundThread(self._run, 'roster-group-commit')
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'documents': 0,
+            'errors': 0,
+            'cancelled': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'total_queue_wait_ms': 0.0,
+            'max_queue_wait_ms': 0.0
+        }
+
+    def submit(self, document, timeout=None):
+        """
+        Queue a document for insertion and block until its batch is flushed
+        Returns a GroupCommitResult or raises the error for this document;
+        raises concurrent.futures.TimeoutError if timeout seconds pass first.
+        A document that timed out while still queued is dropped; one whose
+        batch was already being inserted may still be written
+        """
+        self._worker.ensure_started()
+        future = Future()
+        self._queue.put((document, future, time.monotonic()))
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stats(self):
+        """Return a snapshot of the batching counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches']
+        stats['avg_batch_size'] = stats['documents'] / batches if batches else 0
+        stats['avg_queue_wait_ms'] = (
+            stats['total_queue_wait_ms'] / stats['documents'] if stats['documents'] else 0
+        )
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        """Flusher loop: collect a batch, then insert it"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """Insert a batch with one insert_many and complete each waiting request"""
+        # Drop documents whose requests gave up; the rest can no longer cancel
+        queued = len(batch)
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if len(batch) < queued:
+            with self._stats_lock:
+                self._stats['cancelled'] += queued - len(batch)
+        if not batch:
+            return
+
+        started = time.monotonic()
+        waits_ms = [(started - enqueued) * 1000 for _, _, enqueued in batch]
+        documents = [document for document, _, _ in batch]
+        futures = [future for _, future, _ in batch]
+        errors = {}
+
+        try:
+            client = self.collection.database.client
+            # Bound the batch so a stuck insert cannot hold the flusher forever
+            with pymongo.timeout(self.timeout), \
+                    client.start_session(causal_consistency=True) as session:
+                try:
+                    self.collection.insert_many(documents, ordered=False, session=session)
+                except BulkWriteError as e:
+                    for error in e.details.get('writeErrors', []):
+                        errors[error['index']] = WriteError(
+                            error.get('errmsg'), error.get('code'), error
+                        )
+                    # Inserted documents are not durable if the write concern failed
+                    concern_errors = e.details.get('writeConcernErrors', [])
+                    if concern_errors:
+                        concern_error = WriteConcernError(
+                            concern_errors[0].get('errmsg'), concern_errors[0].get('code'),
+                            concern_errors[0]
+                        )
+                        for index in range(len(batch)):
+                            errors.setdefault(index, concern_error)
+                operation_time = session.operation_time
+        except Exception as e:
+            errors = {index: e for index in range(len(batch))}
+            operation_time = None
+
+        # Documents may be written even when the batch failed (e.g. it timed
+        # out), so notify before completing any request
+        if self.on_commit is not None:
+            try:
+                self.on_commit()
+            except Exception as e:
+                print(f"⚠️  Group commit on_commit callback failed: {e}")
+
+        for index, (document, future) in enumerate(zip(documents, futures)):
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(GroupCommitResult(document['_id'], operation_time))
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['documents'] += len(batch)
+            self._stats['errors'] += len(errors)
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['total_queue_wait_ms'] += sum(waits_ms)
+            self._stats['max_queue_wait_ms'] = max(
+                self._stats['max_queue_wait_ms'], max(waits_ms)
+            )
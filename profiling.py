@@ -0,0 +1,169 @@
+"""
+Per-request sampling profiler for the Manchester Seals API
+
+When enabled, requests that carry the profiling token header (or fall into
+the configured sample rate) are sampled by a background thread. Each profile
+is written as a collapsed-stack file (one "frame;frame;frame count" line per
+stack, ready for flamegraph.pl or speedscope) and summarised in a
+Server-Timing response header. When disabled no hooks are registered.
+"""
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+
+def _in_file(filename, suffix):
+    return filename.replace('\\', '/').endswith(suffix)
+
+
+# Time categories, checked from the innermost frame outwards; the first
+# frame that matches decides where a sample is counted
+CATEGORIES = (
+    ('mongo_wait', lambda filename, name: (
+        _in_file(filename, 'pymongo/network.py')
+        or _in_file(filename, 'pymongo/network_layer.py')
+    )),
+    ('bson_decode', lambda filename, name: (
+        ('/bson/' in filename.replace('\\', '/') and ('decode' in name or 'to_dict' in name))
+        or (_in_file(filename, 'pymongo/message.py') and name == 'unpack_response')
+    )),
+    ('json_encode', lambda filename, name: (
+        _in_file(filename, 'json/encoder.py')
+        or _in_file(filename, 'json/__init__.py') and name == 'dumps'
+        or _in_file(filename, 'flask/json/provider.py')
+    )),
+    ('convert_objectid', lambda filename, name: (
+        name in ('convert_objectid', 'convert_objectid_list')
+    ))
+)
+
+
+def classify(stack):
+    """Return the time category of a sampled stack (root first)"""
+    for filename, name in reversed(stack):
+        for category, matches in CATEGORIES:
+            if matches(filename, name):
+                return category
+    return 'other'
+
+
+def frame_label(filename, name):
+    """Short 'package/module.py:function' label for a collapsed stack frame"""
+    parts = filename.replace('\\', '/').split('/')
+    return f"{'/'.join(parts[-2:])}:{name}"
+
+
+class RequestSampler:
+    """Sample the stack of one thread at a fixed interval until stopped"""
+
+    def __init__(self, thread_id, interval_ms=1):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000.0
+        self.samples = Counter()
+        self.started = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self):
+        """Start sampling"""
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread"""
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def breakdown_ms(self):
+        """Split the request's wall time across categories by sample share"""
+        total_samples = sum(self.samples.values())
+        totals = Counter()
+        for stack, count in self.samples.items():
+            totals[classify(stack)] += count
+        elapsed_ms = self.elapsed * 1000
+        breakdown = {category: 0.0 for category, _ in CATEGORIES}
+        breakdown['other'] = 0.0
+        for category, count in totals.items():
+            breakdown[category] = elapsed_ms * count / total_samples
+        return breakdown
+
+    def collapsed(self):
+        """Render the samples as collapsed-stack lines"""
+        return '\n'.join(
+            f"{';'.join(frame_label(*frame) for frame in stack)} {count}"
+            for stack, count in self.samples.items()
+        ) + '\n'
+
+
+def should_profile(config):
+    """Decide whether the current request is profiled"""
+    token = request.headers.get(PROFILE_HEADER)
+    # compare_digest only accepts ASCII str, and headers are latin-1 decoded
+    if token and config.PROFILE_TOKEN and hmac.compare_digest(
+            token.encode('utf-8'), config.PROFILE_TOKEN.encode('utf-8')):
+        return True
+    return config.PROFILE_SAMPLE_RATE > 0 and random.random() < config.PROFILE_SAMPLE_RATE
+
+
+def init_profiling(app, config):
+    """Register the profiling hooks on an app when profiling is enabled"""
+    if not config.PROFILE_ENABLED:
+        return
+
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+
+    @app.before_request
+    def start_profiling():
+        if should_profile(config):
+            g.profiler = RequestSampler(threading.get_ident(), config.PROFILE_INTERVAL_MS)
+            g.profiler.start()
+
+    @app.after_request
+    def stop_profiling(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.stop()
+
+        filename = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+            f"{request.method}-{request.endpoint or 'unknown'}-"
+            f"{random.getrandbits(32):08x}.collapsed"
+        )
+        with open(os.path.join(config.PROFILE_DIR, filename), 'w') as profile_file:
+            profile_file.write(profiler.collapsed())
+
+        timings = [f"{category};dur={duration:.2f}"
+                   for category, duration in profiler.breakdown_ms().items()]
+        timings.append(f"total;dur={profiler.elapsed * 1000:.2f}")
+        response.headers['Server-Timing'] = ', '.join(timings)
+        response.headers['X-Profile-File'] = filename
+        print(f"🔬 Profiled {request.method} {request.path} -> {filename}")
+        return response
+
+    @app.teardown_request
+    def discard_profiling(error):
+        # Stop the sampler if the request failed before after_request ran
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
@@ -0,0 +1,61 @@
+#!/bin/bash
+# Start or stop a local 3-member MongoDB replica set as plain mongod processes
+# Usage: ./replica_set.sh start|stop|status
+#
+# Point the API at it with:
+#   MONGO_URI=mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0
+
+REPLICA_SET_NAME=${REPLICA_SET_NAME:-rs0}
+DATA_DIR=${DATA_DIR:-./data/replica_set}
+PORTS=(27017 27018 27019)
+
+start() {
+    for port in "${PORTS[@]}"; do
+        mkdir -p "$DATA_DIR/$port"
+        echo "Starting mongod on port $port..."
+        mongod --replSet "$REPLICA_SET_NAME" \
+            --port "$port" \
+            --bind_ip localhost \
+            --dbpath "$DATA_DIR/$port" \
+            --logpath "$DATA_DIR/$port/mongod.log" \
+            --fork || exit 1
+    done
+
+    echo "Initiating replica set $REPLICA_SET_NAME..."
+    mongosh --quiet --port "${PORTS[0]}" --eval "
+        try {
+            rs.status();
+            print('ℹ️  Replica set already initiated');
+        } catch (e) {
+            rs.initiate({
+                _id: '$REPLICA_SET_NAME',
+                members: [
+                    {_id: 0, host: 'localhost:${PORTS[0]}', priority: 2},
+                    {_id: 1, host: 'localhost:${PORTS[1]}'},
+                    {_id: 2, host: 'localhost:${PORTS[2]}'}
+                ]
+            });
+            print('✅ Replica set initiated');
+        }
+    "
+}
+
+stop() {
+    for port in "${PORTS[@]}"; do
+        echo "Stopping mongod on port $port..."
+        mongod --dbpath "$DATA_DIR/$port" --shutdown
+    done
+}
+
+status() {
+    mongosh --quiet --port "${PORTS[0]}" --eval "
+        rs.status().members.forEach(m => print(m.name + '  ' + m.stateStr));
+    "
+}
+
+case "$1" in
+    start) start ;;
+    stop) stop ;;
+    status) status ;;
+    *) echo "Usage: $0 start|stop|status"; exit 1 ;;
+esac
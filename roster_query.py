@@ -0,0 +1,187 @@
+"""
+Filter and sort query language for roster list queries
+
+Query parameters:
+- <field>=<value> or <field>[eq]=<value>: equality
+- <field>[ne|gt|gte|lt|lte]=<value>: comparison
+- <field>[in]=<a>,<b>,<c>: any of the listed values
+- sort=<field>,-<field>: sort keys, '-' for descending
+
+Filters are translated into a MongoDB filter and sort, and the query shape
+is checked against the roster indexes so unindexed queries can be refused.
+"""
+import math
+import re
+from datetime import datetime
+
+OPERATORS = {
+    'eq': None,
+    'ne': '$ne',
+    'gt': '$gt',
+    'gte': '$gte',
+    'lt': '$lt',
+    'lte': '$lte',
+    'in': '$in'
+}
+RANGE_OPERATORS = {'ne', 'gt', 'gte', 'lt', 'lte'}
+RESERVED_PARAMS = {'page', 'limit', 'search', 'sort'}
+FILTER_PARAM = re.compile(r'^(?P<field>\w+)(?:\[(?P<op>\w+)\])?$')
+
+
+class QueryError(ValueError):
+    """Raised for query parameters that are not valid roster queries"""
+
+
+def _parse_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            number = float(value)
+        except ValueError:
+            number = math.nan
+        if not math.isfinite(number):
+            raise QueryError(f"Expected a number, got '{value}'")
+        return number
+
+
+def _parse_date(value):
+    # hire_date is stored as an ISO 'YYYY-MM-DD' string, which sorts correctly
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise QueryError(f"Expected a YYYY-MM-DD date, got '{value}'")
+    return value
+
+
+FIELDS = {
+    'name': str,
+    'position': str,
+    'department': str,
+    'email': str,
+    'salary': _parse_number,
+    'hire_date': _parse_date
+}
+
+
+def parse_filters(args):
+    """
+    Build a MongoDB filter from query parameters
+    Returns (filter, equality_fields, range_fields)
+    """
+    query = {}
+    equality_fields = set()
+    range_fields = set()
+
+    for param in args:
+        if param in RESERVED_PARAMS:
+            continue
+        match = FILTER_PARAM.match(param)
+        if match is None:
+            continue
+        field, op = match.group('field'), match.group('op')
+        if field not in FIELDS:
+            if op is None:
+                continue
+            raise QueryError(f"Unknown filter field '{field}'")
+        op = op or 'eq'
+        if op not in OPERATORS:
+            raise QueryError(f"Unknown filter operator '{op}'")
+
+        parse = FIELDS[field]
+        value = args.get(param)
+        if op == 'in':
+            value = [parse(item) for item in value.split(',') if item]
+        else:
+            value = parse(value)
+
+        if OPERATORS[op] is None:
+            if isinstance(query.get(field), dict):
+                raise QueryError(f"Cannot combine equality and range filters on '{field}'")
+            query[field] = value
+            equality_fields.add(field)
+        else:
+            if field in query and not isinstance(query[field], dict):
+                raise QueryError(f"Cannot combine equality and range filters on '{field}'")
+            query.setdefault(field, {})[OPERATORS[op]] = value
+            if op in RANGE_OPERATORS:
+                range_fields.add(field)
+            else:
+                equality_fields.add(field)
+
+    return query, equality_fields, range_fields
+
+
+def parse_sort(value):
+    """Parse 'field,-field' into a list of (field, direction) sort keys"""
+    sort = []
+    for key in filter(None, (key.strip() for key in (value or '').split(','))):
+        direction = -1 if key.startswith('-') else 1
+        field = key.lstrip('-+')
+        if field not in FIELDS:
+            raise QueryError(f"Unknown sort field '{field}'")
+        if any(existing == field for existing, _ in sort):
+            raise QueryError(f"Duplicate sort field '{field}'")
+        sort.append((field, direction))
+    return sort
+
+
+def index_covers(index, equality_fields, range_fields, sort):
+    """
+    Check whether an index serves a query shape following the
+    equality, sort, range ordering of its keys
+    """
+    keys = [field for field, _ in index]
+    directions = dict(index)
+    position = 0
+
+    # Equality fields must form a prefix of the index (in any order)
+    while position < len(keys) and keys[position] in equality_fields:
+        position += 1
+    if position != len(equality_fields):
+        return False
+
+    # Sort keys must follow, all in index direction or all reversed
+    if sort:
+        sort_keys = [field for field, _ in sort]
+        if keys[position:position + len(sort)] != sort_keys:
+            return False
+        flips = {directions[field] * direction for field, direction in sort}
+        if len(flips) != 1:
+            return False
+        position += len(sort)
+        # A range on a sort key is served by the same index scan
+        remaining_ranges = range_fields - set(sort_keys)
+    else:
+        remaining_ranges = set(range_fields)
+
+    # At most one further range field, on the next index key
+    if not remaining_ranges:
+        return True
+    return len(remaining_ranges) == 1 and keys[position:position + 1] == list(remaining_ranges)
+
+
+def is_indexed(indexes, equality_fields, range_fields, sort):
+    """Check whether any of the indexes serves a query shape"""
+    if not equality_fields and not range_fields and not sort:
+        return True
+    return any(index_covers(index, equality_fields, range_fields, sort) for index in indexes)
+
+
+def parse_roster_query(args, indexes):
+    """
+    Parse filter and sort parameters into a MongoDB query
+    Returns (filter, sort, indexed) where sort ends with an _id tie-breaker
+    and indexed tells whether one of the indexes serves the query shape
+    """
+    query, equality_fields, range_fields = parse_filters(args)
+    sort = parse_sort(args.get('sort'))
+    if sort:
+        # _id breaks ties so pages stay stable; indexes must include it too
+        sort.append(('_id', sort[-1][1]))
+    # A sort key pinned to a single value by an equality filter does not
+    # order the results, so the index only has to serve the remaining keys
+    pinned = {field for field in equality_fields if not isinstance(query[field], dict)}
+    index_sort = [(field, direction) for field, direction in sort if field not in pinned]
+    indexed = is_indexed(indexes, equality_fields, range_fields, index_sort)
+    return query, sort, indexed
@@ -0,0 +1,259 @@
+"""
+Columnar in-memory roster snapshot for analytics endpoints
+
+The roster is loaded into NumPy column arrays (department code, salary,
+hire-date ordinal) and refreshed in the background, periodically and shortly
+after writes, so analytics run as vectorized operations instead of
+per-request MongoDB aggregations.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+from background import BackgroundThread
+
+# Tenure bucket edges in years; the last bucket is open-ended
+TENURE_BINS = [0, 1, 2, 3, 5, 10, 20]
+
+# How often a shared write generation is checked for other workers' writes
+GENERATION_POLL_SECONDS = 1
+
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+Columns = namedtuple('Columns', [
+    'departments', 'department_codes', 'salary', 'hire_ordinal', 'loaded_at'
+])
+
+
+def _hire_ordinal(value):
+    """Convert a hire_date ('YYYY-MM-DD' string or datetime) to a day ordinal"""
+    if isinstance(value, datetime):
+        return value.date().toordinal()
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value[:10]).toordinal()
+        except ValueError:
+            return -1
+    return -1
+
+
+def _salary(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return np.nan
+
+
+def build_columns(documents):
+    """Build column arrays from roster documents"""
+    departments = []
+    codes_by_department = {}
+    department_codes = []
+    salary = []
+    hire_ordinal = []
+
+    for document in documents:
+        department = document.get('department')
+        code = codes_by_department.get(department)
+        if code is None:
+            code = codes_by_department[department] = len(departments)
+            departments.append(department)
+        department_codes.append(code)
+        salary.append(_salary(document.get('salary')))
+        hire_ordinal.append(_hire_ordinal(document.get('hire_date')))
+
+    return Columns(
+        departments=departments,
+        department_codes=np.array(department_codes, dtype=np.int32),
+        salary=np.array(salary, dtype=np.float64),
+        hire_ordinal=np.array(hire_ordinal, dtype=np.int32),
+        loaded_at=time.time()
+    )
+
+
+def salary_percentiles(columns, percentiles):
+    """Salary percentiles per department, ignoring entries without a salary"""
+    has_salary = ~np.isnan(columns.salary)
+    codes = columns.department_codes[has_salary]
+    salary = columns.salary[has_salary]
+
+    # Sort by department then salary, so each department is one sorted slice
+    order = np.lexsort((salary, codes))
+    codes, salary = codes[order], salary[order]
+    bounds = np.searchsorted(codes, np.arange(len(columns.departments) + 1))
+
+    results = []
+    for code, department in enumerate(columns.departments):
+        values = salary[bounds[code]:bounds[code + 1]]
+        if len(values) == 0:
+            continue
+        results.append({
+            'department': department,
+            'count': int(len(values)),
+            'mean': float(values.mean()),
+            'percentiles': {
+                f"{p:g}": float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))
+            }
+        })
+    return results
+
+
+def tenure_distribution(columns, today=None):
+    """Headcount per tenure bucket, overall and per department"""
+    today = (today or date.today()).toordinal()
+    known = columns.hire_ordinal >= 0
+    years = (today - columns.hire_ordinal[known]) / 365.25
+    codes = columns.department_codes[known]
+
+    buckets = np.digitize(years, TENURE_BINS[1:])
+    bucket_count = len(TENURE_BINS)
+    labels = [f"{low}-{high}" for low, high in zip(TENURE_BINS, TENURE_BINS[1:])]
+    labels.append(f"{TENURE_BINS[-1]}+")
+
+    by_department = np.bincount(
+        codes * bucket_count + buckets,
+        minlength=len(columns.departments) * bucket_count
+    ).reshape(len(columns.departments), bucket_count)
+
+    return {
+        'buckets': labels,
+        'overall': dict(zip(labels, by_department.sum(axis=0).tolist())),
+        'by_department': [
+            {'department': department, 'counts': dict(zip(labels, counts.tolist()))}
+            for department, counts in zip(columns.departments, by_department)
+        ],
+        'unknown_hire_date': int((~known).sum())
+    }
+
+
+def headcount_over_time(columns, interval='year'):
+    """Cumulative headcount by hire date at the end of each year or month"""
+    known = columns.hire_ordinal[columns.hire_ordinal >= 0]
+    if len(known) == 0:
+        return []
+    days = (known - UNIX_EPOCH_ORDINAL).astype('datetime64[D]')
+    unit = 'Y' if interval == 'year' else 'M'
+    periods = days.astype(f'datetime64[{unit}]').astype(np.int64)
+
+    first = periods.min()
+    hires = np.bincount(periods - first)
+    headcount = np.cumsum(hires)
+    labels = np.arange(first, first + len(hires)).astype(f'datetime64[{unit}]').astype(str)
+    return [
+        {'period': label, 'hires': int(count), 'headcount': int(total)}
+        for label, count, total in zip(labels, hires, headcount)
+    ]
+
+
+class RosterSnapshot:
+    """
+    Periodically refreshed columnar copy of the roster collection
+    mark_dirty() only reaches the snapshot of the process that handled the
+    write. Pass write_generation, a callable returning a counter shared by
+    all workers that changes on every write (such as the shared response
+    cache generation), to pick up writes made by other workers as well
+    """
+
+    def __init__(self, collection, refresh_seconds=300, min_refresh_seconds=5,
+                 write_generation=None):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.write_generation = write_generation
+        self._loaded_generation = None
+        self._columns = None
+        self._dirty = threading.Event()
+        self._worker = BackgroundThread(self._run, 'roster-snapshot')
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent's thread may have held the event's lock mid-wait
+        dirty = self._dirty.is_set()
+        self._dirty = threading.Event()
+        if dirty:
+            self._dirty.set()
+
+    def refresh(self):
+        """
+        Reload the columns from MongoDB
+        Only the snapshot thread calls this once started; it takes no lock,
+        so a worker forked mid-load is never left waiting for one
+        """
+        self._dirty.clear()
+        # Read before loading, so writes made during the load count as pending
+        generation = self.write_generation() if self.write_generation else None
+        documents = self.collection.find(
+            {}, {'_id': 0, 'department': 1, 'salary': 1, 'hire_date': 1}
+        )
+        self._columns = build_columns(documents)
+        self._loaded_generation = generation
+        return self._columns
+
+    def mark_dirty(self):
+        """Schedule a refresh after a write"""
+        self._dirty.set()
+
+    def pending_writes(self):
+        """Whether writes have happened since the current columns were loaded"""
+        if self._dirty.is_set():
+            return True
+        if self.write_generation is None:
+            return False
+        return self.write_generation() != self._loaded_generation
+
+    def start(self):
+        """Start loading in the background; call at startup to warm up"""
+        self._worker.ensure_started()
+
+    def columns(self):
+        """
+        Current columns, or None while the first load is still running
+        Loading never happens on the caller's thread, so requests are not
+        held up (or bound by their deadline) by a full collection scan
+        """
+        self._worker.ensure_started()
+        return self._columns
+
+    def describe(self, columns):
+        """Staleness information reported with every analytics response"""
+        return {
+            'rows': int(len(columns.department_codes)),
+            'loaded_at': datetime.fromtimestamp(columns.loaded_at, timezone.utc).isoformat(),
+            'age_seconds': round(time.time() - columns.loaded_at, 3),
+            'pending_writes': self.pending_writes(),
+            'write_signal': 'shared' if self.write_generation else 'local'
+        }
+
+    def _run(self):
+        """Load at once, then refresh every refresh_seconds or soon after writes"""
+        while True:
+            columns = self._columns
+            if columns is not None:
+                self._wait_for_writes(columns.loaded_at + self.refresh_seconds)
+                since_load = time.time() - columns.loaded_at
+                if since_load < self.min_refresh_seconds:
+                    time.sleep(self.min_refresh_seconds - since_load)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️  Roster snapshot refresh failed: {e}")
+                time.sleep(self.min_refresh_seconds)
+
+    def _wait_for_writes(self, deadline):
+        """Wait until writes are pending or the periodic refresh is due"""
+        while True:
+            left = deadline - time.time()
+            if left <= 0:
+                return
+            if self.write_generation is not None:
+                left = min(left, GENERATION_POLL_SECONDS)
+            if self._dirty.wait(left):
+                return
+            try:
+                if self.pending_writes():
+                    return
+            except Exception as e:
+                print(f"⚠️  Roster snapshot could not check for writes: {e}")
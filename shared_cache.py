@@ -0,0 +1,226 @@
+"""
+Shared-memory response cache for the Manchester Seals API
+
+Serialized responses are kept in a fixed-size mmap-backed file (by default
+under /dev/shm) shared by every worker process on the host. The file is a
+set-associative table of fixed-size slots with LRU eviction inside each set.
+A generation counter in the header invalidates every entry at once: bumping
+it from any worker makes all older slots misses for all workers.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+MAGIC = b'MSCACHE1'
+# magic, generation, LRU clock, slot size, slot count
+HEADER = struct.Struct('<8sQQII')
+HEADER_SIZE = 64
+# key digest, generation, last used, created at, status code, body length
+SLOT_HEADER = struct.Struct('<16sQQdHI')
+SLOT_HEADER_SIZE = 48
+
+
+def default_cache_path(namespace, size_bytes, slot_bytes):
+    """
+    Cache file for one deployment and layout, on tmpfs so it never touches
+    disk. Deployments (MongoDB URI and database) get separate files, and a
+    layout change starts a new file instead of resizing one in use
+    """
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+    tag = hashlib.blake2b(namespace.encode('utf-8'), digest_size=8).hexdigest()
+    return os.path.join(
+        directory, f'manchester_seals_cache-{tag}-{size_bytes}-{slot_bytes}'
+    )
+
+
+class CacheLayoutError(RuntimeError):
+    """Raised when an existing cache file was created with a different layout"""
+
+
+class SharedResponseCache:
+    """LRU cache of (status, body bytes) shared across processes via mmap"""
+
+    def __init__(self, path, size_bytes, slot_bytes=16384, ways=8, ttl_seconds=60,
+                 namespace=''):
+        self.path = path
+        self.namespace = namespace
+        self.slot_bytes = slot_bytes
+        self.ways = ways
+        self.ttl_seconds = ttl_seconds
+        self.slots = max((size_bytes - HEADER_SIZE) // slot_bytes // ways, 1) * ways
+        self.sets = self.slots // ways
+        self.size_bytes = HEADER_SIZE + self.slots * slot_bytes
+        self.capacity = slot_bytes - SLOT_HEADER_SIZE
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'too_large': 0}
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    # -------------------- locking & mapping --------------------
+
+    def _open(self):
+        """Map the cache file, reopening after a fork so flock works per process"""
+        if self._pid == os.getpid():
+            return
+        if self._fd is not None:
+            # Inherited from the parent: share the memory, not the lock
+            self._map.close()
+            os.close(self._fd)
+            self._fd = self._map = None
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            # Only a brand-new (empty) file is sized; other workers may have
+            # an existing file mapped, and shrinking it would SIGBUS them
+            size = os.fstat(fd).st_size
+            if size == 0:
+                os.ftruncate(fd, self.size_bytes)
+            elif size != self.size_bytes:
+                raise CacheLayoutError(
+                    f"{self.path} is {size} bytes, expected {self.size_bytes}; "
+                    "remove it or use another CACHE_PATH"
+                )
+            cache_map = mmap.mmap(fd, self.size_bytes)
+            magic, _, _, slot_bytes, slots = HEADER.unpack_from(cache_map, 0)
+            if magic != MAGIC:
+                HEADER.pack_into(cache_map, 0, MAGIC, 1, 0, self.slot_bytes, self.slots)
+            elif slot_bytes != self.slot_bytes or slots != self.slots:
+                cache_map.close()
+                raise CacheLayoutError(
+                    f"{self.path} has {slots} slots of {slot_bytes} bytes, expected "
+                    f"{self.slots} of {self.slot_bytes}; remove it or use another CACHE_PATH"
+                )
+        except Exception:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            raise
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._map, self._pid = fd, cache_map, os.getpid()
+
+    def open(self):
+        """Map the cache now, raising CacheLayoutError if the file does not fit"""
+        with self._locked():
+            pass
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and the cross-process file lock"""
+        with self._thread_lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _header(self):
+        return HEADER.unpack_from(self._map, 0)
+
+    def _tick(self):
+        """Advance the shared LRU clock"""
+        magic, generation, clock, slot_bytes, slots = self._header()
+        HEADER.pack_into(self._map, 0, magic, generation, clock + 1, slot_bytes, slots)
+        return clock + 1
+
+    def _set_offsets(self, digest):
+        first = int.from_bytes(digest[:8], 'little') % self.sets * self.ways
+        return [HEADER_SIZE + (first + way) * self.slot_bytes for way in range(self.ways)]
+
+    def _live(self, slot, generation, now):
+        _, slot_generation, _, created, _, _ = slot
+        return slot_generation == generation and now - created < self.ttl_seconds
+
+    # -------------------- public API --------------------
+
+    def digest(self, key):
+        return hashlib.blake2b(
+            f"{self.namespace}|{key}".encode('utf-8'), digest_size=16
+        ).digest()
+
+    def generation(self):
+        """Current generation; pass it back to set() to avoid caching stale data"""
+        with self._locked():
+            return self._header()[1]
+
+    def get(self, key):
+        """Return (status, body) for a live entry, or None"""
+        digest = self.digest(key)
+        now = time.time()
+        with self._locked():
+            generation = self._header()[1]
+            for offset in self._set_offsets(digest):
+                slot = SLOT_HEADER.unpack_from(self._map, offset)
+                if slot[0] == digest and self._live(slot, generation, now):
+                    SLOT_HEADER.pack_into(
+                        self._map, offset, digest, generation, self._tick(), slot[3], slot[4], slot[5]
+                    )
+                    start = offset + SLOT_HEADER_SIZE
+                    self.stats['hits'] += 1
+                    return slot[4], bytes(self._map[start:start + slot[5]])
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, key, status, body, generation):
+        """
+        Store a response computed under the given generation. Skipped if the
+        generation moved on meanwhile (a write happened) or the body does not fit
+        """
+        if len(body) > self.capacity:
+            with self._thread_lock:
+                self.stats['too_large'] += 1
+            return False
+        digest = self.digest(key)
+        now = time.time()
+        with self._locked():
+            if self._header()[1] != generation:
+                return False
+            victim, victim_used = None, None
+            for offset in self._set_offsets(digest):
+                slot = SLOT_HEADER.unpack_from(self._map, offset)
+                if slot[0] == digest or not self._live(slot, generation, now):
+                    victim, victim_used = offset, -1
+                    break
+                if victim is None or slot[2] < victim_used:
+                    victim, victim_used = offset, slot[2]
+            if victim_used != -1:
+                self.stats['evictions'] += 1
+            SLOT_HEADER.pack_into(
+                self._map, victim, digest, generation, self._tick(), now, status, len(body)
+            )
+            start = victim + SLOT_HEADER_SIZE
+            self._map[start:start + len(body)] = body
+            self.stats['sets'] += 1
+        return True
+
+    def invalidate(self):
+        """Bump the generation, invalidating every entry for every worker"""
+        with self._locked():
+            magic, generation, clock, slot_bytes, slots = self._header()
+            HEADER.pack_into(self._map, 0, magic, generation + 1, clock, slot_bytes, slots)
+
+    def describe(self):
+        """Shared and per-process cache counters"""
+        now = time.time()
+        with self._locked():
+            generation = self._header()[1]
+            entries = sum(
+                1 for index in range(self.slots)
+                if self._live(SLOT_HEADER.unpack_from(
+                    self._map, HEADER_SIZE + index * self.slot_bytes), generation, now)
+            )
+            stats = dict(self.stats)
+        return {
+            'path': self.path,
+            'size_bytes': self.size_bytes,
+            'slots': self.slots,
+            'entries': entries,
+            'generation': generation,
+            'pid': os.getpid(),
+            **stats
+        }
@@ -4,13 +4,39 @@ Unit tests for the Manchester Seals API
 import unittest
 import json
 import os
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
 from unittest.mock import patch, MagicMock
+from flask import Flask, jsonify
 from bson import ObjectId
+from bson.timestamp import Timestamp
+import pymongo
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, SecondaryPreferred
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pymongo.errors import (
+    BulkWriteError, ExecutionTimeout, ServerSelectionTimeoutError, WriteConcernError,
+    WriteError
+)
 from app import app
+from group_commit import GroupCommitter
+from profiling import classify, init_profiling
+from roster_query import QueryError, parse_roster_query
+from roster_snapshot import (
+    RosterSnapshot, build_columns, headcount_over_time, salary_percentiles,
+    tenure_distribution
+)
+from datetime import date
+from shared_cache import CacheLayoutError, SharedResponseCache, default_cache_path
 
 load_dotenv()
 
+# Import the extended app without connecting to a real MongoDB
+with patch('pymongo.MongoClient'):
+    import app_extended
+
 
 class RosterAPITestCase(unittest.TestCase):
     """Test cases for roster API endpoints"""
@@ -82,6 +108,18 @@ class RosterAPITestCase(unittest.TestCase):
         self.assertFalse(data['success'])
         self.assertIn('error', data)
 
+    @patch('app.MongoClient')
+    def test_get_roster_deadline_exceeded(self, mock_mongo_client):
+        """Test a Mongo timeout is returned as a distinct 504"""
+        mock_client = mock_mongo_client.return_value
+        mock_client.admin.command.side_effect = ExecutionTimeout('operation exceeded time limit')
+
+        response = self.client.get('/api/roster')
+        self.assertEqual(response.status_code, 504)
+        data = json.loads(response.data)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['error'], 'Request deadline exceeded')
+
     def test_404_endpoint(self):
         """Test 404 error handling"""
         response = self.client.get('/api/nonexistent')
@@ -90,6 +128,793 @@ class RosterAPITestCase(unittest.TestCase):
         self.assertFalse(data['success'])
 
 
+class ExtendedRosterAPITestCase(unittest.TestCase):
+    """Test cases for the extended roster API endpoints"""
+
+    def setUp(self):
+        """Set up test client with mocked MongoDB client and collection"""
+        self.app = app_extended.app
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+        self.mongo_client = MagicMock()
+        self.collection = MagicMock()
+        self.read_collection = self.collection.with_options.return_value
+
+        for name, value in (('client', self.mongo_client),
+                            ('roster_collection', self.collection)):
+            patcher = patch.object(app_extended, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_get_by_id_reads_primary_preferred(self):
+        """Test get-by-id is routed with its configured read preference"""
+        self.read_collection.find_one.return_value = {
+            '_id': ObjectId('507f1f77bcf86cd799439011'),
+            'name': 'John Doe'
+        }
+
+        response = self.client.get('/api/roster/507f1f77bcf86cd799439011')
+        self.assertEqual(response.status_code, 200)
+        self.collection.with_options.assert_called_once_with(
+            read_preference=PrimaryPreferred()
+        )
+
+    def test_stats_read_secondary_preferred_with_staleness(self):
+        """Test stats are routed to secondaries with maxStalenessSeconds"""
+        self.read_collection.count_documents.return_value = 3
+
+        response = self.client.get('/api/roster/stats/count')
+        self.assertEqual(response.status_code, 200)
+        self.collection.with_options.assert_called_once_with(
+            read_preference=SecondaryPreferred(max_staleness=90)
+        )
+
+    def test_write_returns_session_token(self):
+        """Test a write hands back its causal-consistency session token"""
+        session = self.mongo_client.start_session.return_value.__enter__.return_value
+        session.operation_time = Timestamp(1700000000, 3)
+        self.collection.insert_one.return_value.inserted_id = ObjectId()
+
+        response = self.client.post('/api/roster', json={'name': 'John Doe'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.headers['X-Session-Token'], '1700000000.3')
+
+    def test_read_with_session_token_is_causally_consistent(self):
+        """Test a read with a session token advances the session operation time"""
+        session = self.mongo_client.start_session.return_value
+        session.__enter__.return_value = session
+        self.read_collection.find_one.return_value = None
+
+        response = self.client.get(
+            '/api/roster/507f1f77bcf86cd799439011',
+            headers={'X-Session-Token': '1700000000.3'}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.mongo_client.start_session.assert_called_once_with(causal_consistency=True)
+        session.advance_operation_time.assert_called_once_with(Timestamp(1700000000, 3))
+        self.read_collection.find_one.assert_called_once_with(
+            {'_id': ObjectId('507f1f77bcf86cd799439011')}, session=session
+        )
+
+    def test_batch_get_preserves_order_and_marks_missing(self):
+        """Test batch-get resolves ids with one $in query in request order"""
+        first = '507f1f77bcf86cd799439011'
+        second = '507f1f77bcf86cd799439012'
+        missing = '507f1f77bcf86cd799439013'
+        self.read_collection.find.return_value = [
+            {'_id': ObjectId(first), 'name': 'John Doe'},
+            {'_id': ObjectId(second), 'name': 'Jane Smith'}
+        ]
+
+        response = self.client.post('/api/roster/batch-get', json={
+            'ids': [second, missing, first, second]
+        })
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(data['found'], 3)
+        self.assertEqual([r['id'] for r in data['data']], [second, missing, first, second])
+        self.assertFalse(data['data'][1]['found'])
+        self.assertEqual(data['data'][2]['data']['name'], 'John Doe')
+
+        self.read_collection.find.assert_called_once()
+        query = self.read_collection.find.call_args[0][0]
+        self.assertCountEqual(query['_id']['$in'],
+                              [ObjectId(first), ObjectId(second), ObjectId(missing)])
+
+    def test_batch_get_rejects_invalid_and_oversized(self):
+        """Test batch-get validates ids and the batch size cap"""
+        response = self.client.post('/api/roster/batch-get', json={
+            'ids': ['507f1f77bcf86cd799439011', 'bad-id']
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['invalid_ids'], ['bad-id'])
+
+        with patch.object(app_extended.Config, 'MAX_BATCH_GET_SIZE', 1):
+            response = self.client.post('/api/roster/batch-get', json={
+                'ids': ['507f1f77bcf86cd799439011', '507f1f77bcf86cd799439012']
+            })
+        self.assertEqual(response.status_code, 400)
+        self.read_collection.find.assert_not_called()
+
+    def test_list_pushes_filters_and_sort_down(self):
+        """Test list filters and sort are translated into the Mongo query"""
+        self.read_collection.count_documents.return_value = 0
+        cursor = self.read_collection.find.return_value
+        cursor.sort.return_value.skip.return_value.limit.return_value = []
+
+        response = self.client.get(
+            '/api/roster?department=Engineering&salary[gte]=100000&sort=salary'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('warnings', json.loads(response.data))
+        self.read_collection.find.assert_called_once_with(
+            {'department': 'Engineering', 'salary': {'$gte': 100000}}, session=None
+        )
+        cursor.sort.assert_called_once_with([('salary', 1), ('_id', 1)])
+
+    def test_list_unindexed_query_policy(self):
+        """Test unindexed filter shapes are flagged or rejected"""
+        self.read_collection.count_documents.return_value = 0
+        self.read_collection.find.return_value.skip.return_value.limit.return_value = []
+
+        response = self.client.get('/api/roster?position=Manager')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('warnings', json.loads(response.data))
+
+        with patch.object(app_extended.Config, 'UNINDEXED_QUERY_POLICY', 'reject'):
+            response = self.client.get('/api/roster?position=Manager')
+        self.assertEqual(response.status_code, 400)
+
+    def test_snapshot_stats_report_staleness(self):
+        """Test snapshot analytics endpoints report snapshot freshness"""
+        self.collection.with_options.return_value.find.return_value = [
+            {'department': 'Engineering', 'salary': 100000, 'hire_date': '2020-01-15'}
+        ]
+        snapshot = RosterSnapshot(self.collection.with_options.return_value)
+        patcher = patch.object(snapshot._worker, 'ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with patch.object(app_extended, 'roster_snapshot', snapshot):
+            response = self.client.get('/api/roster/stats/tenure')
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('warming up', json.loads(response.data)['error'])
+            snapshot.refresh()
+
+            response = self.client.get('/api/roster/stats/salary-percentiles?percentiles=nan')
+            self.assertEqual(response.status_code, 400)
+
+            response = self.client.get('/api/roster/stats/salary-percentiles?percentiles=50')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(data['data'][0]['percentiles']['50'], 100000)
+            self.assertEqual(data['snapshot']['rows'], 1)
+            self.assertFalse(data['snapshot']['pending_writes'])
+
+            self.collection.update_one.return_value.matched_count = 1
+            self.client.put('/api/roster/507f1f77bcf86cd799439011', json={'salary': 1})
+            response = self.client.get('/api/roster/stats/tenure')
+            self.assertTrue(json.loads(response.data)['snapshot']['pending_writes'])
+
+        response = self.client.get('/api/roster/stats/headcount')
+        self.assertEqual(response.status_code, 503)
+
+    def test_shared_cache_serves_hits_and_invalidates_on_write(self):
+        """Test get-by-id and batch-get use the shared cache until a write"""
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache = SharedResponseCache(
+            os.path.join(cache_dir.name, 'cache'), 1024 * 1024, slot_bytes=4096
+        )
+        entry_id = '507f1f77bcf86cd799439011'
+        self.read_collection.find_one.return_value = {'_id': ObjectId(entry_id), 'name': 'John Doe'}
+
+        with patch.object(app_extended, 'response_cache', cache):
+            first = self.client.get(f'/api/roster/{entry_id}')
+            second = self.client.get(f'/api/roster/{entry_id}')
+            self.assertEqual(first.headers['X-Cache'], 'MISS')
+            self.assertEqual(second.headers['X-Cache'], 'HIT')
+            self.assertEqual(first.data, second.data)
+            self.assertEqual(self.read_collection.find_one.call_count, 1)
+
+            response = self.client.post('/api/roster/batch-get', json={'ids': [entry_id]})
+            self.assertEqual(json.loads(response.data)['data'][0]['data']['name'], 'John Doe')
+            self.read_collection.find.assert_not_called()
+
+            self.collection.delete_one.return_value.deleted_count = 1
+            self.client.delete(f'/api/roster/{entry_id}')
+            third = self.client.get(f'/api/roster/{entry_id}')
+            self.assertEqual(third.headers['X-Cache'], 'MISS')
+            self.assertEqual(self.read_collection.find_one.call_count, 2)
+
+    def test_shared_cache_is_not_filled_from_a_lagging_secondary(self):
+        """Test cache misses after a write are read from the primary"""
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache = SharedResponseCache(
+            os.path.join(cache_dir.name, 'cache'), 1024 * 1024, slot_bytes=4096
+        )
+        primary, secondary = MagicMock(), MagicMock()
+        self.collection.with_options.side_effect = lambda read_preference: (
+            primary if read_preference == Primary() else secondary
+        )
+        primary.count_documents.return_value = 3
+        secondary.count_documents.return_value = 3
+
+        with patch.object(app_extended, 'response_cache', cache):
+            self.client.get('/api/roster/stats/count')
+            self.client.post('/api/roster', json={'name': 'Jane Doe'})
+            # The secondary has not applied the insert yet
+            primary.count_documents.return_value = 4
+
+            first = self.client.get('/api/roster/stats/count')
+            second = self.client.get('/api/roster/stats/count')
+
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(second.data)['count'], 4)
+        secondary.count_documents.assert_not_called()
+
+    def test_deadline_propagates_into_mongo(self):
+        """Test Mongo operations run under the request budget"""
+        self.read_collection.find_one.return_value = None
+        with patch('deadlines.pymongo.timeout', wraps=pymongo.timeout) as timeout:
+            self.client.get('/api/roster/507f1f77bcf86cd799439011',
+                            headers={'X-Request-Timeout-Ms': '250'})
+            self.client.get('/api/roster/507f1f77bcf86cd799439011')
+
+        self.assertEqual([c.args[0] for c in timeout.call_args_list], [0.25, 1.0])
+
+    def test_deadline_exceeded_returns_504(self):
+        """Test expired budgets and Mongo timeouts return 504 and are counted"""
+        before = app_extended.deadline_stats()['exceeded']
+
+        response = self.client.get('/api/roster/stats/count',
+                                   headers={'X-Request-Timeout-Ms': '0'})
+        self.assertEqual(response.status_code, 504)
+        self.read_collection.count_documents.assert_not_called()
+
+        self.read_collection.count_documents.side_effect = ExecutionTimeout('timed out')
+        response = self.client.get('/api/roster/stats/count')
+        self.assertEqual(response.status_code, 504)
+
+        stats = json.loads(self.client.get('/api/metrics').data)['deadlines']
+        self.assertEqual(stats['exceeded'], before + 2)
+        self.assertGreaterEqual(stats['exceeded_by_endpoint']['get_roster_count'], 2)
+
+        for header in ('soon', 'nan', 'inf'):
+            response = self.client.get('/api/roster/stats/count',
+                                       headers={'X-Request-Timeout-Ms': header})
+            self.assertEqual(response.status_code, 400)
+
+    def test_unreachable_mongo_is_not_a_deadline(self):
+        """Test timeouts before the budget is spent are failures, not 504s"""
+        before = app_extended.deadline_stats()['exceeded']
+        self.read_collection.count_documents.side_effect = ServerSelectionTimeoutError(
+            'No replica set members found'
+        )
+        response = self.client.get('/api/roster/stats/count')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(app_extended.deadline_stats()['exceeded'], before)
+
+        def spend_budget(*args, **kwargs):
+            time.sleep(0.02)
+            raise ServerSelectionTimeoutError('timed out')
+
+        self.read_collection.count_documents.side_effect = spend_budget
+        response = self.client.get('/api/roster/stats/count',
+                                   headers={'X-Request-Timeout-Ms': '10'})
+        self.assertEqual(response.status_code, 504)
+
+    def test_invalid_session_token(self):
+        """Test a malformed session token is rejected"""
+        response = self.client.get(
+            '/api/roster/stats/count',
+            headers={'X-Session-Token': 'not-a-token'}
+        )
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertFalse(data['success'])
+
+
+class GroupCommitTestCase(unittest.TestCase):
+    """Test cases for batching concurrent inserts into insert_many"""
+
+    def setUp(self):
+        """Set up a committer over a mocked collection"""
+        self.collection = MagicMock()
+        self.inserted_batches = []
+
+        def insert_many(documents, ordered, session):
+            self.inserted_batches.append(list(documents))
+            for document in documents:
+                document['_id'] = ObjectId()
+
+        self.collection.insert_many.side_effect = insert_many
+        self.committer = GroupCommitter(self.collection, max_batch_size=10, max_wait_ms=200)
+
+    def test_concurrent_submits_share_one_insert_many(self):
+        """Test concurrent submits are flushed together and get their own ids"""
+        documents = [{'name': f'Person {i}'} for i in range(5)]
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(self.committer.submit, documents))
+
+        self.assertEqual(len(self.inserted_batches), 1)
+        self.assertEqual(len(self.inserted_batches[0]), 5)
+        self.assertEqual([r.inserted_id for r in results], [d['_id'] for d in documents])
+
+        stats = self.committer.stats()
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['documents'], 5)
+        self.assertEqual(stats['max_batch_size'], 5)
+
+    def test_write_error_only_fails_its_document(self):
+        """Test a per-document write error is returned to that request only"""
+        def insert_many(documents, ordered, session):
+            for document in documents:
+                document['_id'] = ObjectId()
+            raise BulkWriteError({'writeErrors': [
+                {'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}
+            ]})
+
+        self.collection.insert_many.side_effect = insert_many
+        self.committer.max_batch_size = 2
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(self.committer.submit, {'name': 'Fine'})
+            time.sleep(0.05)
+            second = pool.submit(self.committer.submit, {'name': 'Duplicate'})
+            self.assertIsNotNone(first.result().inserted_id)
+            with self.assertRaises(WriteError):
+                second.result()
+        self.assertEqual(self.committer.stats()['errors'], 1)
+
+    def test_write_concern_error_fails_the_batch(self):
+        """Test a write concern failure is not reported as a success"""
+        def insert_many(documents, ordered, session):
+            for document in documents:
+                document['_id'] = ObjectId()
+            raise BulkWriteError({'writeErrors': [], 'writeConcernErrors': [
+                {'code': 64, 'errmsg': 'waiting for replication timed out'}
+            ]})
+
+        self.collection.insert_many.side_effect = insert_many
+        self.committer.max_wait = 0
+
+        with self.assertRaises(WriteConcernError):
+            self.committer.submit({'name': 'Not durable'})
+
+    def test_timed_out_submit_is_dropped_from_its_batch(self):
+        """Test a document whose request timed out while queued is not inserted"""
+        release = threading.Event()
+        insert_many = self.collection.insert_many.side_effect
+
+        def blocking_insert_many(documents, ordered, session):
+            release.wait(5)
+            insert_many(documents, ordered, session)
+
+        self.collection.insert_many.side_effect = blocking_insert_many
+        self.committer.max_batch_size = 1
+        self.committer.on_commit = MagicMock()
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            first = pool.submit(self.committer.submit, {'name': 'First'})
+            time.sleep(0.05)
+            with self.assertRaises(FutureTimeoutError):
+                self.committer.submit({'name': 'Gave up'}, timeout=0.05)
+            release.set()
+            first.result()
+        self.committer.submit({'name': 'Last'})
+
+        self.assertEqual(
+            [[d['name'] for d in batch] for batch in self.inserted_batches],
+            [['First'], ['Last']]
+        )
+        self.assertEqual(self.committer.stats()['cancelled'], 1)
+        self.assertEqual(self.committer.on_commit.call_count, 2)
+
+
+class ProfilingTestCase(unittest.TestCase):
+    """Test cases for the per-request profiling hooks"""
+
+    def make_app(self, **settings):
+        """Build a small app with profiling configured from settings"""
+        profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_dir.cleanup)
+        config = type('ProfileConfig', (), {
+            'PROFILE_ENABLED': True,
+            'PROFILE_TOKEN': 'secret',
+            'PROFILE_SAMPLE_RATE': 0,
+            'PROFILE_INTERVAL_MS': 1,
+            'PROFILE_DIR': profile_dir.name,
+            **settings
+        })
+        test_app = Flask(__name__)
+        init_profiling(test_app, config)
+
+        def convert_objectid_list():
+            time.sleep(0.05)
+
+        @test_app.route('/slow')
+        def slow():
+            convert_objectid_list()
+            return jsonify({'success': True})
+
+        return test_app, profile_dir.name
+
+    def test_authorized_request_writes_collapsed_stacks(self):
+        """Test a request with the profiling token is sampled and written out"""
+        test_app, profile_dir = self.make_app()
+        response = test_app.test_client().get('/slow', headers={'X-Profile-Token': 'secret'})
+
+        self.assertIn('convert_objectid;dur=', response.headers['Server-Timing'])
+        path = os.path.join(profile_dir, response.headers['X-Profile-File'])
+        with open(path) as profile_file:
+            lines = profile_file.read().splitlines()
+        self.assertTrue(any(':convert_objectid_list' in line for line in lines))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+    def test_unprofiled_requests(self):
+        """Test wrong tokens and disabled profiling leave requests untouched"""
+        test_app, profile_dir = self.make_app()
+        response = test_app.test_client().get('/slow', headers={'X-Profile-Token': 'wrong'})
+        self.assertNotIn('Server-Timing', response.headers)
+        response = test_app.test_client().get('/slow', headers={'X-Profile-Token': 'é'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(os.listdir(profile_dir), [])
+
+        test_app, _ = self.make_app(PROFILE_ENABLED=False)
+        self.assertEqual(test_app.before_request_funcs, {})
+
+    def test_classify_innermost_category_wins(self):
+        """Test samples are attributed to the innermost recognised frame"""
+        stack = (
+            ('/app/app_extended.py', 'convert_objectid_list'),
+            ('/site-packages/pymongo/cursor.py', 'next'),
+            ('/site-packages/pymongo/network.py', 'receive_message')
+        )
+        self.assertEqual(classify(stack), 'mongo_wait')
+        self.assertEqual(classify(stack[:2]), 'convert_objectid')
+        self.assertEqual(classify((('/app/app.py', 'get_roster'),)), 'other')
+
+
+class RosterQueryTestCase(unittest.TestCase):
+    """Test cases for the roster filter and sort query language"""
+
+    INDEXES = [
+        [('department', 1), ('salary', 1), ('_id', 1)],
+        [('hire_date', 1), ('_id', 1)]
+    ]
+
+    def test_filters_and_sort(self):
+        """Test equality, range and in filters with multi-key sort"""
+        query, sort, indexed = parse_roster_query({
+            'department[in]': 'Engineering,Design',
+            'salary[gt]': '90000',
+            'salary[lte]': '120000.5',
+            'sort': 'department,-salary',
+            'page': '2'
+        }, self.INDEXES)
+        self.assertEqual(query, {
+            'department': {'$in': ['Engineering', 'Design']},
+            'salary': {'$gt': 90000, '$lte': 120000.5}
+        })
+        self.assertEqual(sort, [('department', 1), ('salary', -1), ('_id', -1)])
+        self.assertFalse(indexed)
+
+    def test_index_coverage(self):
+        """Test query shapes are matched against index key order"""
+        def indexed(args):
+            return parse_roster_query(args, self.INDEXES)[2]
+
+        self.assertTrue(indexed({}))
+        self.assertTrue(indexed({'department': 'Design', 'salary[gte]': '1'}))
+        self.assertTrue(indexed({'department': 'Design', 'sort': '-salary'}))
+        self.assertTrue(indexed({'hire_date[lt]': '2021-01-01', 'sort': 'hire_date'}))
+        self.assertTrue(indexed({'department': 'Design', 'sort': 'department,salary'}))
+        self.assertTrue(indexed({'department': 'Design', 'sort': 'salary,department'}))
+        self.assertFalse(indexed({'salary[gte]': '1'}))
+        self.assertFalse(indexed({'department': 'Design', 'hire_date[lt]': '2021-01-01'}))
+
+        # The _id tie-breaker needs the index to end with _id
+        without_id = [[('department', 1), ('salary', 1)]]
+        self.assertFalse(parse_roster_query(
+            {'department': 'Design', 'sort': 'salary'}, without_id)[2])
+        self.assertTrue(parse_roster_query({'department': 'Design'}, without_id)[2])
+
+    def test_invalid_queries(self):
+        """Test malformed filters and sorts are rejected"""
+        for args in ({'salary[gte]': 'lots'},
+                     {'salary': 'nan'},
+                     {'salary[lt]': 'inf'},
+                     {'salary[in]': '1,-inf'},
+                     {'hire_date': '15/01/2020'},
+                     {'password[eq]': 'x'},
+                     {'salary[like]': '1'},
+                     {'sort': 'password'},
+                     {'sort': 'name,-name'}):
+            with self.assertRaises(QueryError):
+                parse_roster_query(args, self.INDEXES)
+
+
+class RosterSnapshotTestCase(unittest.TestCase):
+    """Test cases for the columnar roster snapshot analytics"""
+
+    def setUp(self):
+        """Build columns from a small roster"""
+        self.columns = build_columns([
+            {'department': 'Engineering', 'salary': 100000, 'hire_date': '2019-03-20'},
+            {'department': 'Design', 'salary': 90000, 'hire_date': '2021-02-14'},
+            {'department': 'Engineering', 'salary': 120000, 'hire_date': '2020-01-15'},
+            {'department': 'Engineering', 'salary': 140000, 'hire_date': '2020-06-01'},
+            {'department': 'Design', 'hire_date': 'unknown'}
+        ])
+
+    def test_salary_percentiles(self):
+        """Test per-department percentiles skip entries without a salary"""
+        results = {r['department']: r for r in salary_percentiles(self.columns, [0, 50.0, 100])}
+        self.assertEqual(results['Engineering']['percentiles'],
+                         {'0': 100000, '50': 120000, '100': 140000})
+        self.assertEqual(results['Design']['count'], 1)
+
+    def test_tenure_distribution(self):
+        """Test tenure buckets are counted overall and per department"""
+        tenure = tenure_distribution(self.columns, today=date(2022, 1, 1))
+        self.assertEqual(tenure['overall']['0-1'], 1)
+        self.assertEqual(tenure['overall']['1-2'], 2)
+        self.assertEqual(tenure['overall']['2-3'], 1)
+        self.assertEqual(tenure['unknown_hire_date'], 1)
+
+    def test_headcount_over_time(self):
+        """Test headcount accumulates hires per period"""
+        self.assertEqual(headcount_over_time(self.columns), [
+            {'period': '2019', 'hires': 1, 'headcount': 1},
+            {'period': '2020', 'hires': 2, 'headcount': 3},
+            {'period': '2021', 'hires': 1, 'headcount': 4}
+        ])
+        self.assertEqual(len(headcount_over_time(self.columns, 'month')), 24)
+
+    def test_snapshot_warms_up_in_the_background(self):
+        """Test the first load runs on the snapshot thread, not the caller's"""
+        collection = MagicMock()
+        loaded_by = []
+
+        def find(*args):
+            loaded_by.append(threading.current_thread().name)
+            return [{'department': 'Design', 'salary': 90000, 'hire_date': '2021-02-14'}]
+
+        collection.find.side_effect = find
+        snapshot = RosterSnapshot(collection)
+        snapshot.start()
+        for _ in range(100):
+            if snapshot.columns() is not None:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(len(snapshot.columns().department_codes), 1)
+        self.assertEqual(loaded_by, ['roster-snapshot'])
+
+    def test_shared_write_generation_triggers_a_refresh(self):
+        """Test writes made by other workers are reported and picked up"""
+        collection = MagicMock()
+        collection.find.return_value = [{'department': 'Design', 'salary': 1}]
+        generation = [1]
+        snapshot = RosterSnapshot(collection, min_refresh_seconds=0,
+                                  write_generation=lambda: generation[0])
+        columns = snapshot.refresh()
+        self.assertFalse(snapshot.describe(columns)['pending_writes'])
+
+        generation[0] += 1
+        self.assertTrue(snapshot.describe(columns)['pending_writes'])
+
+        snapshot.start()
+        for _ in range(300):
+            if snapshot.columns() is not columns:
+                break
+            time.sleep(0.01)
+        self.assertIsNot(snapshot.columns(), columns)
+        self.assertFalse(snapshot.pending_writes())
+
+    def test_worker_forked_during_warm_up_loads_its_own_snapshot(self):
+        """Test a worker forked while the parent is loading is not left waiting"""
+        collection = MagicMock()
+
+        def find(*args):
+            time.sleep(0.3)
+            return [{'department': 'Design', 'salary': 90000, 'hire_date': '2021-02-14'}]
+
+        collection.find.side_effect = find
+        snapshot = RosterSnapshot(collection)
+        snapshot.start()
+        time.sleep(0.1)
+
+        pid = os.fork()
+        if pid == 0:
+            for _ in range(300):
+                if snapshot.columns() is not None:
+                    os._exit(0)
+                time.sleep(0.01)
+            os._exit(1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class SharedResponseCacheTestCase(unittest.TestCase):
+    """Test cases for the cross-process shared response cache"""
+
+    def make_cache(self, **options):
+        """Create a small cache backed by a temporary file"""
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        path = os.path.join(cache_dir.name, 'cache')
+        return SharedResponseCache(path, 64 * 1024, slot_bytes=1024, **options)
+
+    def test_entries_are_shared_across_processes(self):
+        """Test an entry stored by a forked worker is visible to the parent"""
+        cache = self.make_cache()
+        self.assertIsNone(cache.get('page-1'))
+
+        pid = os.fork()
+        if pid == 0:
+            cache.set('page-1', 200, b'{"success": true}', cache.generation())
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(cache.get('page-1'), (200, b'{"success": true}'))
+
+    def test_generation_bump_invalidates_everything(self):
+        """Test invalidation and stale-generation writes"""
+        cache = self.make_cache()
+        generation = cache.generation()
+        cache.set('a', 200, b'a', generation)
+        cache.invalidate()
+
+        self.assertIsNone(cache.get('a'))
+        self.assertFalse(cache.set('b', 200, b'b', generation))
+        self.assertFalse(cache.set('c', 200, b'x' * 2048, cache.generation()))
+
+    def test_lru_eviction_within_a_set(self):
+        """Test the least recently used entry is evicted when a set is full"""
+        cache = self.make_cache(ways=2)
+        cache.sets = 1
+        generation = cache.generation()
+        cache.set('a', 200, b'a', generation)
+        cache.set('b', 200, b'b', generation)
+        cache.get('a')
+        cache.set('c', 200, b'c', generation)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_layout_mismatch_refuses_to_open(self):
+        """Test an existing file is never resized for a different layout"""
+        cache = self.make_cache()
+        cache.set('a', 200, b'a', cache.generation())
+
+        for size, slot_bytes in ((128 * 1024, 1024), (64 * 1024, 2048)):
+            other = SharedResponseCache(cache.path, size, slot_bytes=slot_bytes)
+            with self.assertRaises(CacheLayoutError):
+                other.open()
+        self.assertEqual(os.path.getsize(cache.path), cache.size_bytes)
+        self.assertEqual(cache.get('a'), (200, b'a'))
+
+    def test_namespaces_do_not_share_entries(self):
+        """Test deployments sharing a file and key get separate entries"""
+        cache = self.make_cache(namespace='mongodb://a|roster')
+        other = SharedResponseCache(
+            cache.path, 64 * 1024, slot_bytes=1024, namespace='mongodb://b|roster'
+        )
+        cache.set('page-1', 200, b'a', cache.generation())
+
+        self.assertIsNone(other.get('page-1'))
+        self.assertNotEqual(
+            default_cache_path('mongodb://a|roster', 1024, 64),
+            default_cache_path('mongodb://b|roster', 1024, 64)
+        )
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Record the server address every MongoDB command was sent to"""
+
+    def __init__(self):
+        self.events = []
+
+    def started(self, event):
+        self.events.append(event)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+REPLICA_SET_URI = os.getenv('MONGO_URI', '')
+
+
+@unittest.skipUnless(
+    'replicaSet=' in REPLICA_SET_URI,
+    'MONGO_URI does not point at a replica set (start one with make replset-up)'
+)
+class ReplicaSetIntegrationTestCase(unittest.TestCase):
+    """Integration tests for read routing against a local 3-member replica set"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Connect to the replica set with command monitoring"""
+        cls.recorder = CommandRecorder()
+        cls.mongo_client = pymongo.MongoClient(
+            REPLICA_SET_URI, serverSelectionTimeoutMS=5000, event_listeners=[cls.recorder]
+        )
+        cls.mongo_client.admin.command('ping')
+        cls.collection = cls.mongo_client[app_extended.DB_NAME]['roster_integration_test']
+
+    @classmethod
+    def tearDownClass(cls):
+        """Drop the test collection and disconnect"""
+        cls.collection.drop()
+        cls.mongo_client.close()
+
+    def setUp(self):
+        """Point the extended app at the replica set"""
+        self.app = app_extended.app
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+        for name, value in (('client', self.mongo_client),
+                            ('roster_collection', self.collection),
+                            ('group_committer', None),
+                            ('response_cache', None)):
+            patcher = patch.object(app_extended, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.collection.insert_one({'name': 'Seed', 'department': 'Integration'})
+        self.addCleanup(self.collection.delete_many, {})
+        self.recorder.events.clear()
+
+    def commands(self, name):
+        """Recorded commands of one kind against the test collection"""
+        return [
+            event for event in self.recorder.events
+            if event.command_name == name
+            and event.command.get(name) == self.collection.name
+        ]
+
+    def test_list_and_stats_read_from_a_secondary(self):
+        """Test list and stats reads are sent to a secondary, not the primary"""
+        primary = self.mongo_client.primary
+        self.assertEqual(self.client.get('/api/roster').status_code, 200)
+        self.assertEqual(self.client.get('/api/roster/stats/count').status_code, 200)
+
+        reads = self.commands('find') + self.commands('aggregate')
+        self.assertGreaterEqual(len(reads), 2)
+        for event in reads:
+            self.assertNotEqual(event.connection_id, primary)
+
+    def test_session_token_reads_its_own_write(self):
+        """Test a secondary read sent with the write's session token sees it"""
+        name = f'Integration {ObjectId()}'
+        response = self.client.post('/api/roster', json={'name': name, 'department': 'Integration'})
+        self.assertEqual(response.status_code, 201)
+        token = response.headers['X-Session-Token']
+
+        self.recorder.events.clear()
+        response = self.client.get('/api/roster', query_string={'name': name},
+                                   headers={'X-Session-Token': token})
+        self.assertEqual([entry['name'] for entry in json.loads(response.data)['data']], [name])
+
+        find = self.commands('find')[0]
+        self.assertNotEqual(find.connection_id, self.mongo_client.primary)
+        self.assertIn('afterClusterTime', find.command['readConcern'])
+
+
 if __name__ == '__main__':
     unittest.main()
 